@@ -1,6 +1,9 @@
 # app.py
-import base64
-from flask import Flask, request, jsonify
+import io
+
+from flask import Flask, request, jsonify, send_file
+
+from handlers import decode_archivos, encode_result
 
 # Importa la lógica de Word
 from lector_word import (
@@ -11,6 +14,8 @@ from lector_word import (
 
 app = Flask(__name__)
 
+DOCX_MIMETYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
 
 @app.route("/", methods=["GET"])
 def health():
@@ -29,16 +34,14 @@ def api_headings():
     """
     data = request.get_json(force=True, silent=False)
     out = {}
-    for a in data.get("archivos", []):
-        name = a.get("name", "archivo.docx")
-        content_b64 = a.get("content")
-        if not content_b64:
+    for a in decode_archivos(data):
+        name = a["name"]
+        if not a["content"]:
             out[name] = []
             continue
         try:
-            b = base64.b64decode(content_b64)
-            out[name] = headings_from_docx(b)
-        except Exception as e:
+            out[name] = headings_from_docx(a["content"])
+        except Exception:
             out[name] = []
     return jsonify(out)
 
@@ -52,6 +55,7 @@ def api_merge():
           "unificado.docx": "<BASE64>",
           "tablas.xlsx": "<BASE64>"
         }
+      Con include_xlsx = false solo se genera y devuelve "unificado.docx".
 
     - Agrupado por título (group_by_title = true):
         * Si return_array = true:
@@ -62,19 +66,8 @@ def api_merge():
     """
     data = request.get_json(force=True, silent=False)
 
-    # Entrada de archivos [{ name, content(base64) }]
-    archivos = []
-    for a in data.get("archivos", []):
-        if not a or "content" not in a:
-            continue
-        try:
-            archivos.append({
-                "name": a.get("name", "archivo.docx"),
-                "content": base64.b64decode(a["content"])
-            })
-        except Exception:
-            # ignora archivos corruptos
-            pass
+    # Entrada de archivos [{ name, content(base64) }]; vacíos/corruptos se ignoran al procesar
+    archivos = decode_archivos(data)
 
     niveles = data.get("niveles", [1, 2, 3])
     titulos = data.get("titulos_exactos", [])
@@ -83,6 +76,7 @@ def api_merge():
     group_by_title = bool(data.get("group_by_title", False))
     group_level = int(data.get("group_level", 1))           # 1=H1, 2=H2, 3=H3
     return_array = bool(data.get("return_array", False))    # para PA
+    include_xlsx = bool(data.get("include_xlsx", True))
 
     if group_by_title:
         grouped = procesar_grouped(
@@ -91,15 +85,12 @@ def api_merge():
             titulos_objetivo=titulos,
             enforce_whitelist=enforce_whitelist,
         )
+        out = encode_result(grouped)
         if return_array:
-            files = [
-                {"filename": k, "content": base64.b64encode(v).decode("utf-8")}
-                for k, v in grouped.items()
-            ]
+            files = [{"filename": k, "content": v} for k, v in out.items()]
             return jsonify({"files": files})
 
         # compat: objeto con claves dinámicas
-        out = {k: base64.b64encode(v).decode("utf-8") for k, v in grouped.items()}
         return jsonify(out)
 
     # Modo clásico: 1 Word + 1 Excel
@@ -108,11 +99,55 @@ def api_merge():
         niveles=niveles,
         titulos=titulos,
         enforce_whitelist=enforce_whitelist,
+        generate_xlsx=include_xlsx,
+    )
+    return jsonify(encode_result(result))
+
+
+@app.route("/api/merge/upload", methods=["POST"])
+def api_merge_upload():
+    """
+    Variante binaria del modo clásico (sin JSON ni base64):
+      - Entrada multipart/form-data:
+          archivos:          uno o varios .docx (campo repetido)
+          niveles:           opcional, repetido o "1,2,3"
+          titulos_exactos:   opcional, repetido
+          enforce_whitelist: opcional, "true"/"false"
+      - Salida: 'unificado.docx' como adjunto binario (400 si 'niveles' no es válido).
+    """
+    archivos = []
+    for f in request.files.getlist("archivos"):
+        content = f.stream.read()
+        if content:
+            archivos.append({"name": f.filename or "archivo.docx", "content": content})
+
+    try:
+        niveles = [
+            int(n)
+            for v in request.form.getlist("niveles")
+            for n in v.split(",")
+            if n.strip()
+        ] or [1, 2, 3]
+    except ValueError:
+        return jsonify({"error": "niveles debe ser una lista de enteros"}), 400
+    titulos = request.form.getlist("titulos_exactos")
+    enforce_whitelist = request.form.get("enforce_whitelist", "").lower() in ("1", "true", "yes")
+
+    result = procesar(
+        archivos=archivos,
+        niveles=niveles,
+        titulos=titulos,
+        enforce_whitelist=enforce_whitelist,
+        generate_xlsx=False,
+    )
+    return send_file(
+        io.BytesIO(result["unificado.docx"]),
+        mimetype=DOCX_MIMETYPE,
+        as_attachment=True,
+        download_name="unificado.docx",
     )
-    out = {k: base64.b64encode(v).decode("utf-8") for k, v in result.items()}
-    return jsonify(out)
 
 
 if __name__ == "__main__":
-    # para pruebas locales
+    # para pruebas locales; en producción: `gunicorn app:app` (ver gunicorn.conf.py)
     app.run(host="0.0.0.0", port=8000, debug=False)
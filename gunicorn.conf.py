@@ -0,0 +1,16 @@
+# gunicorn.conf.py
+# Configuración de producción: `gunicorn app:app` carga este archivo automáticamente.
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# Pocos procesos web (cada uno carga python-docx, lxml y openpyxl) con
+# varios hilos para solapar la E/S de subidas y respuestas grandes. El parseo de DOCX,
+# que es lo que consume CPU, va al pool de procesos de lector_word
+# (LECTOR_WORD_PARSE_WORKERS). Subir WEB_CONCURRENCY solo si hay memoria de sobra.
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+# Las uniones de muchos documentos pueden tardar más que el timeout por defecto (30 s)
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
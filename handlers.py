@@ -0,0 +1,50 @@
+# handlers.py
+# Conversión JSON <-> bytes compartida por los endpoints de app.py
+import binascii
+import re
+from typing import Any, Dict, List
+
+import pybase64
+
+
+_ESPACIOS = re.compile(r"\s")
+
+
+def _b64decode(content_b64: str) -> bytes:
+    """
+    Decodifica base64 validando (ruta SIMD de pybase64, falla en el primer carácter
+    inválido). Solo si el texto trae saltos de línea u otros espacios se reintenta en
+    modo permisivo; cualquier otro carácter inválido propaga binascii.Error.
+    """
+    try:
+        return pybase64.b64decode(content_b64, validate=True)
+    except binascii.Error:
+        if _ESPACIOS.search(content_b64) is None:
+            raise
+        return pybase64.b64decode(content_b64, validate=False)
+
+
+def decode_archivos(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Entrada: {"archivos": [{"name": "...", "content": "<BASE64>"}, ...]}
+    Salida:  [{"name": "...", "content": bytes}, ...] en el mismo orden.
+    Los archivos sin contenido o con base64 corrupto quedan con content = b""
+    (procesar/procesar_grouped los ignoran; /api/headings responde []).
+    """
+    archivos = []
+    for a in data.get("archivos", []) or []:
+        a = a or {}
+        content = b""
+        if a.get("content"):
+            try:
+                content = _b64decode(a["content"])
+            except Exception:
+                # ignora archivos corruptos
+                content = b""
+        archivos.append({"name": a.get("name", "archivo.docx"), "content": content})
+    return archivos
+
+
+def encode_result(result: Dict[str, bytes]) -> Dict[str, str]:
+    """{"nombre": bytes} -> {"nombre": "<BASE64>"}"""
+    return {k: pybase64.b64encode_as_string(v) for k, v in result.items()}
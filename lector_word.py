@@ -1,100 +1,374 @@
 # lector_word.py
-from typing import List, Dict, Tuple, Any
+from typing import List, Dict, Optional, Tuple, Any
+import copy
+import functools
+import hashlib
 import io
+import multiprocessing
+import os
+import posixpath
 import re
+import threading
 import unicodedata
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 from docx import Document
-from docxcompose.composer import Composer
+from docx.oxml import parse_xml
+from docx.oxml.table import CT_Tbl
+from lxml import etree
 from openpyxl import Workbook
 
 
 # ---------------------------- Utilidades ----------------------------
 
+@functools.lru_cache(maxsize=8192)
 def _normalize(text: str) -> str:
     if text is None:
         return ""
+    if text.isascii():
+        # ASCII puro: NFKD no cambia nada y no hay marcas combinantes
+        return " ".join(text.split()).lower()
     t = unicodedata.normalize("NFKD", text)
     t = "".join(c for c in t if not unicodedata.combining(c))
-    t = re.sub(r"\s+", " ", t).strip().casefold()
+    t = " ".join(t.split()).casefold()
     return t
 
 
-def base_title(text: str) -> str:
-    return _normalize(text)
+# _normalize ya está cacheado: base_title es el mismo callable
+base_title = _normalize
 
 
-def allowed_by_whitelist(level: int, text: str) -> bool:
-    # Aquí podrías aplicar tu plantilla de títulos permitidos
-    # Por defecto: permitido
-    return True
+# Plantilla de títulos permitidos por nivel (texto tal como aparece en Word).
+# Vacía por defecto => todo permitido.
+WHITELIST_TITULOS: Dict[int, List[str]] = {1: [], 2: [], 3: []}
+
+# Un único conjunto de pares (nivel, título normalizado): una sola búsqueda por heading
+_WHITELIST: frozenset = frozenset(
+    (lvl, base_title(t)) for lvl, titulos in WHITELIST_TITULOS.items() for t in titulos
+)
 
 
-# Bloque = ('h', level, text) | ('p', None, text) | ('t', None, rows:list[list[str]])
-Block = Tuple[str, Any, Any]
+def allowed_by_whitelist(level: int, text: str) -> bool:
+    return not _WHITELIST or (level, base_title(text)) in _WHITELIST
+
+
+# Bloque = ('h', level, text, base_title(text)) | ('p', None, text, None)
+#        | ('t', None, rows:list[list[str]], tbl_xml:bytes|None)
+# tbl_xml es el <w:tbl> original serializado (picklable, para copiarlo con su formato);
+# None si la tabla referencia partes del documento fuente (imágenes, notas, ...).
+Block = Tuple[str, Any, Any, Any]
+
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+_NS = {"w": W_NS}
+_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+_REL_OFFICE_DOCUMENT = "/officeDocument"
+_REL_STYLES = "/styles"
+
+def _cpus_disponibles() -> int:
+    """CPUs que puede usar este proceso (afinidad), o cpu_count() si no se conoce."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # sin sched_getaffinity (macOS, Windows)
+        return os.cpu_count() or 1
+
+
+# Modelo de concurrencia: pocos procesos web (gunicorn.conf.py, 2 por defecto) y, en
+# cada uno, un pool de procesos para parsear en paralelo los DOCX de una petición,
+# por defecto de tantos procesos como CPUs disponibles.
+# LECTOR_WORD_PARSE_WORKERS lo ajusta (1 = sin pool: se parsea en el propio worker).
+_PARSE_WORKERS = max(int(os.environ.get("LECTOR_WORD_PARSE_WORKERS", _cpus_disponibles())), 1)
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+# Caché LRU de bloques por documento: blake2b(bytes) -> bloques
+_BLOQUES_CACHE_MAX = 32
+_bloques_cache: "OrderedDict[bytes, List[Block]]" = OrderedDict()
+_bloques_cache_lock = threading.Lock()
+
+
+def _w(tag: str) -> str:
+    return f"{{{W_NS}}}{tag}"
+
+
+_P_TAG = _w("p")
+_TBL_TAG = _w("tbl")
+_BODY_TAG = _w("body")
+_XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+
+
+def _rel_target(z: zipfile.ZipFile, rels_name: str, base_dir: str,
+                type_suffix: str, default: str) -> str:
+    """Resuelve el destino de la primera relación cuyo tipo termina en 'type_suffix'."""
+    try:
+        rels = etree.fromstring(z.read(rels_name))
+    except KeyError:
+        return default
+    for rel in rels.iterfind(f"{{{_REL_NS}}}Relationship"):
+        if rel.get("Type", "").endswith(type_suffix):
+            target = rel.get("Target", "")
+            if target.startswith("/"):
+                return target.lstrip("/")
+            return posixpath.normpath(posixpath.join(base_dir, target))
+    return default
+
+
+# Nombres de estilo conocidos -> nivel de heading (0 = no es heading)
+# (incluye estilos personalizados con nombre en español: "Título 1", "Titulo 1")
+_STYLE_LEVEL: Dict[str, int] = {
+    f"{prefijo} {n}": n
+    for prefijo in ("heading", "titulo", "título")
+    for n in range(1, 10)
+}
+_STYLE_LEVEL.update({"normal": 0, "title": 0, "subtitle": 0, "body text": 0,
+                     "list paragraph": 0, "no spacing": 0, "caption": 0, "quote": 0})
+_HEADING_RE = re.compile(r"(?:Heading|T[ií]tulo)\s+(\d+)", flags=re.I)
+
+
+def _nivel_estilo(style_name: str) -> int:
+    """Nivel de heading según el nombre del estilo; regex solo si no está en la tabla."""
+    lvl = _STYLE_LEVEL.get(style_name.lower())
+    if lvl is not None:
+        return lvl
+    m = _HEADING_RE.match(style_name)
+    return int(m.group(1)) if m else 0
+
+
+def _estilos_parrafo(styles_xml: bytes) -> Tuple[Dict[str, int], str]:
+    """
+    Devuelve ({styleId: nivel} de los estilos de párrafo que son headings,
+    styleId por defecto). Se calcula una vez por documento.
+    """
+    niveles: Dict[str, int] = {}
+    default_id = ""
+    if not styles_xml:
+        return niveles, default_id
+    root = etree.fromstring(styles_xml)
+    for st in root.iterfind(_w("style")):
+        if st.get(_w("type")) != "paragraph":
+            continue
+        sid = st.get(_w("styleId")) or ""
+        name = st.find(_w("name"))
+        lvl = _nivel_estilo(name.get(_w("val"), "") if name is not None else sid)
+        if lvl:
+            niveles[sid] = lvl
+        if st.get(_w("default")) in ("1", "true", "on"):
+            default_id = sid
+    return niveles, default_id
+
+
+# XPaths precompilados (se evalúan por cada párrafo/celda)
+# contenido de texto de los runs, como CT_R.text de python-docx
+_RUN_TEXT_XP = etree.XPath(
+    "(w:r | w:hyperlink/w:r)/*[self::w:t or self::w:tab or self::w:ptab or self::w:br"
+    " or self::w:cr or self::w:noBreakHyphen]",
+    namespaces=_NS,
+)
+_PSTYLE_XP = etree.XPath("string(w:pPr/w:pStyle/@w:val)", namespaces=_NS)
+_TBL_REFS_XP = etree.XPath(
+    ".//@*[namespace-uri() = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships']"
+    " | .//w:footnoteReference | .//w:endnoteReference | .//w:commentReference | .//w:numPr",
+    namespaces=_NS,
+)
+_TBL_STYLES_XP = etree.XPath(
+    ".//w:tblStyle/@w:val | .//w:pStyle/@w:val | .//w:rStyle/@w:val", namespaces=_NS
+)
+_TBL_BOOKMARKS_XP = etree.XPath(".//w:bookmarkStart | .//w:bookmarkEnd", namespaces=_NS)
+
+
+_T_TAG = _w("t")
+_BR_TAG = _w("br")
+_RUN_CHARS = {_w("tab"): "\t", _w("ptab"): "\t", _w("cr"): "\n", _w("noBreakHyphen"): "-"}
+
+
+def _texto_parrafo(p) -> str:
+    partes = []
+    for el in _RUN_TEXT_XP(p):
+        if el.tag == _T_TAG:
+            partes.append(el.text or "")
+        elif el.tag == _BR_TAG:
+            # saltos de página/columna no aportan texto
+            if el.get(_w("type"), "textWrapping") == "textWrapping":
+                partes.append("\n")
+        else:
+            partes.append(_RUN_CHARS[el.tag])
+    return "".join(partes)
+
+
+def _filas_tabla(tbl) -> List[List[str]]:
+    """
+    Texto de cada celda por fila, como lo expone python-docx: las celdas con
+    gridSpan se repiten y las continuaciones de vMerge toman el texto de la celda origen.
+    """
+    rows: List[List[str]] = []
+    for tr in tbl.iterfind(_w("tr")):
+        row: List[str] = []
+        for tc in tr.iterfind(_w("tc")):
+            ps = tc.findall(_P_TAG)
+            if len(ps) == 1:
+                # caso típico: una celda = un párrafo, sin join intermedio
+                text = _texto_parrafo(ps[0]).strip()
+            else:
+                text = "\n".join(_texto_parrafo(p) for p in ps).strip()
+            span = 1
+            tc_pr = tc.find(_w("tcPr"))
+            if tc_pr is not None:
+                grid_span = tc_pr.find(_w("gridSpan"))
+                if grid_span is not None:
+                    span = max(int(grid_span.get(_w("val"), "1") or 1), 1)
+                v_merge = tc_pr.find(_w("vMerge"))
+                if (v_merge is not None and v_merge.get(_w("val"), "continue") == "continue"
+                        and rows and len(row) < len(rows[-1])):
+                    text = rows[-1][len(row)]
+            row.extend([text] * span)
+        rows.append(row)
+    return rows
+
+
+def _tabla_copiable(tbl) -> Optional[bytes]:
+    """
+    Serializa el <w:tbl> para pegarlo tal cual en la salida, o None si depende de
+    otras partes del documento fuente (relaciones r:*, notas, comentarios,
+    numeraciones) o de estilos que no existen en la plantilla destino
+    (_ESTILOS_DESTINO).
+    """
+    if _TBL_REFS_XP(tbl) or not _ESTILOS_DESTINO.issuperset(_TBL_STYLES_XP(tbl)):
+        return None
+    tbl = copy.deepcopy(tbl)
+    # los ids de marcadores chocarían entre documentos; no aportan al contenido
+    for el in _TBL_BOOKMARKS_XP(tbl):
+        el.getparent().remove(el)
+    return etree.tostring(tbl)
 
 
-def _extraer_bloques(doc_bytes: bytes) -> List[Block]:
-    """Lee un DOCX y extrae una lista de bloques (headings, párrafos y tablas)."""
-    f = io.BytesIO(doc_bytes)
-    d = Document(f)
+def _extraer_bloques(doc_bytes: bytes, headings_only: bool = False) -> List[Block]:
+    """
+    Lee un DOCX y extrae una lista de bloques (headings, párrafos y tablas).
+    Solo lectura: se parsea el XML del documento con lxml sin pasar por python-docx.
+    Con headings_only=True solo devuelve los headings: no se extrae el texto de los
+    párrafos normales ni las tablas (para listar títulos).
+    """
     blocks: List[Block] = []
-
-    # Recorremos elementos en orden: párrafos y tablas
-    # python-docx no provee orden directo; iteramos con _body._element
-    from docx.oxml.text.paragraph import CT_P
-    from docx.oxml.table import CT_Tbl
-    for child in d.element.body.iterchildren():
-        if isinstance(child, CT_P):
-            p = Document().add_paragraph()._p.__class__(child)  # no se usa, solo tip
-        # Tomemos el texto y estilo usando un wrapper simple
-        if isinstance(child, CT_P):
-            para = d._body._element.xpath(".")[0]  # dummy to keep mypy calm
-            # Recuperamos el paragraph real:
-            paragraph = None
-            for p in d.paragraphs:
-                if p._p is child:
-                    paragraph = p
-                    break
-            if paragraph is None:
-                continue
-            style_name = (paragraph.style.name if paragraph.style else "") or ""
-            m = re.match(r"Heading\s+(\d+)", style_name, flags=re.I)
-            if m:
-                level = int(m.group(1))
-                text = paragraph.text.strip()
-                blocks.append(("h", level, text))
-            else:
-                text = paragraph.text.strip()
-                if text:
-                    blocks.append(("p", None, text))
-
-        elif isinstance(child, CT_Tbl):
-            # Buscar la tabla que corresponde
-            table_obj = None
-            for t in d.tables:
-                if t._tbl is child:
-                    table_obj = t
-                    break
-            if table_obj is None:
-                continue
-            rows = []
-            for r in table_obj.rows:
-                row = []
-                for c in r.cells:
-                    row.append((c.text or "").strip())
-                rows.append(row)
-            if rows:
-                blocks.append(("t", None, rows))
+    with zipfile.ZipFile(io.BytesIO(doc_bytes)) as z:
+        main = _rel_target(z, "_rels/.rels", "", _REL_OFFICE_DOCUMENT, "word/document.xml")
+        main_dir, main_name = posixpath.split(main)
+        styles = _rel_target(z, posixpath.join(main_dir, "_rels", main_name + ".rels"),
+                             main_dir, _REL_STYLES, "word/styles.xml")
+        try:
+            styles_xml = z.read(styles)
+        except KeyError:
+            styles_xml = b""
+        niveles_estilo, estilo_default = _estilos_parrafo(styles_xml)
+
+        # Recorremos en streaming los hijos directos del body en orden (párrafos y
+        # tablas) y liberamos cada uno tras procesarlo: la memoria no crece con el
+        # tamaño del documento.
+        # Sin resolver entidades ni acceder a la red (XXE), y un DOCX válido nunca
+        # trae DTD: se rechaza en cuanto aparece
+        with z.open(main) as f:
+            revisar_dtd = True
+            for _, child in etree.iterparse(f, events=("end",), tag=(_P_TAG, _TBL_TAG),
+                                            resolve_entities=False, no_network=True):
+                if revisar_dtd:
+                    if child.getroottree().docinfo.doctype:
+                        raise ValueError(f"{main}: DTD no permitido")
+                    revisar_dtd = False
+                body = child.getparent()
+                if body is None or body.tag != _BODY_TAG:
+                    continue  # párrafos dentro de tablas, etc.: se leen con su tabla
+
+                if child.tag == _P_TAG:
+                    style_id = _PSTYLE_XP(child) or estilo_default
+                    lvl = niveles_estilo.get(style_id)
+                    if lvl:
+                        text = _texto_parrafo(child).strip()
+                        blocks.append(("h", lvl, text, base_title(text)))
+                    elif not headings_only:
+                        text = _texto_parrafo(child).strip()
+                        if text:
+                            blocks.append(("p", None, text, None))
+
+                elif not headings_only:
+                    rows = _filas_tabla(child)
+                    if rows:
+                        blocks.append(("t", None, rows, _tabla_copiable(child)))
+
+                child.clear()
+                while child.getprevious() is not None:
+                    del body[0]
 
     return blocks
 
 
+def _get_parse_pool() -> ProcessPoolExecutor:
+    """Pool de procesos compartido para parsear DOCX en paralelo (se crea al primer uso)."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # 'forkserver': seguro aunque el servidor tenga hilos (gunicorn gthread)
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=_PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+        return _parse_pool
+
+
+def _clave_cache(doc_bytes: bytes) -> bytes:
+    return hashlib.blake2b(doc_bytes, digest_size=16).digest()
+
+
+def _extraer_bloques_todos(contenidos: List[bytes]) -> List[List[Block]]:
+    """
+    _extraer_bloques para varios documentos, en el mismo orden.
+    Reutiliza la caché LRU (p.ej. /api/merge repetido con los mismos archivos) y
+    parsea lo que falte en paralelo cuando hay más de un documento.
+    Las listas devueltas son compartidas con la caché: no modificarlas.
+    """
+    claves = [_clave_cache(c) for c in contenidos]
+    resultados: Dict[bytes, List[Block]] = {}
+    with _bloques_cache_lock:
+        for k in claves:
+            if k in _bloques_cache:
+                _bloques_cache.move_to_end(k)
+                resultados[k] = _bloques_cache[k]
+
+    faltan: Dict[bytes, bytes] = {}
+    for k, c in zip(claves, contenidos):
+        if k not in resultados:
+            faltan.setdefault(k, c)
+    if faltan:
+        if len(faltan) < 2 or _PARSE_WORKERS < 2:
+            nuevos = [_extraer_bloques(c) for c in faltan.values()]
+        else:
+            nuevos = list(_get_parse_pool().map(_extraer_bloques, faltan.values()))
+        resultados.update(zip(faltan.keys(), nuevos))
+        with _bloques_cache_lock:
+            for k in faltan:
+                _bloques_cache[k] = resultados[k]
+                _bloques_cache.move_to_end(k)
+            while len(_bloques_cache) > _BLOQUES_CACHE_MAX:
+                _bloques_cache.popitem(last=False)
+
+    return [resultados[k] for k in claves]
+
+
 def headings_from_docx(doc_bytes: bytes) -> List[Dict[str, Any]]:
-    """Devuelve [{level:int, text:str}, ...] en orden."""
-    bloques = _extraer_bloques(doc_bytes)
+    """
+    Devuelve [{level:int, text:str}, ...] en orden.
+    Usa la extracción completa si ya está en caché; si no, solo recorre los headings
+    (sin texto de párrafos ni tablas) y no guarda nada en la caché.
+    """
+    k = _clave_cache(doc_bytes)
+    with _bloques_cache_lock:
+        bloques = _bloques_cache.get(k)
+        if bloques is not None:
+            _bloques_cache.move_to_end(k)
+    if bloques is None:
+        bloques = _extraer_bloques(doc_bytes, headings_only=True)
     out = []
-    for kind, lvl, txt in bloques:
+    for kind, lvl, txt, _ in bloques:
         if kind == "h":
             out.append({"level": int(lvl), "text": str(txt)})
     return out
@@ -102,36 +376,84 @@ def headings_from_docx(doc_bytes: bytes) -> List[Dict[str, Any]]:
 
 # ---------------------------- Composición ----------------------------
 
+def _build_empty() -> bytes:
+    bio = io.BytesIO()
+    Document().save(bio)
+    return bio.getvalue()
+
+
+# Plantilla vacía serializada una vez: abrirla desde bytes evita la carga del
+# template por defecto del paquete en cada documento de salida
+_EMPTY_DOC_BYTES = _build_empty()
+
+# styleIds definidos en la plantilla vacía: solo se copian tablas que usen estos
+_ESTILOS_DESTINO: frozenset = frozenset(
+    s.style_id for s in Document(io.BytesIO(_EMPTY_DOC_BYTES)).styles
+)
+
+
 def _new_doc() -> Document:
-    d = Document()
-    # DocxComposer necesita un doc no vacío; agregamos un párrafo vacío
-    d.add_paragraph("")
-    return d
+    # Document() vacío (solo sectPr) sobre el que se escriben las secciones
+    return Document(io.BytesIO(_EMPTY_DOC_BYTES))
 
 
-def _append_part(composer: Composer, blocks: List[Block], start: int, end: int):
+def _append_part(doc: Document, blocks: List[Block], start: int,
+                 end: int) -> List[List[List[str]]]:
     """
-    Toma los bloques [start:end] (comenzando en un heading) y los envuelve en un doc
-    temporal para apendear al composer.
+    Escribe los bloques [start:end] (comenzando en un heading) al final del documento
+    de salida 'doc' (antes de su sectPr). Todo lo escrito es texto o tablas sin
+    referencias a otras partes ni estilos ajenos (ver _tabla_copiable), así que no hay
+    nada que mapear como haría docxcompose. Devuelve las tablas escritas (filas) para
+    que el llamador las reutilice sin recorrer el rango otra vez.
     """
-    part = Document()
+    tablas: List[List[List[str]]] = []
     # heading original
-    kind, lvl, txt = blocks[start]
-    h = part.add_heading(level=min(max(int(lvl), 1), 6))
+    lvl, txt = blocks[start][1], blocks[start][2]
+    h = doc.add_heading(level=min(max(int(lvl), 1), 6))
     h.add_run(txt or "")
 
     for b in blocks[start + 1:end]:
         if b[0] == "p":
-            part.add_paragraph(b[2] or "")
+            doc.add_paragraph(b[2] or "")
         elif b[0] == "t":
-            rows = b[2]
-            if rows and rows[0]:
-                t = part.add_table(rows=len(rows), cols=len(rows[0]))
-                for i, row in enumerate(rows):
-                    for j, val in enumerate(row):
-                        t.cell(i, j).text = val or ""
+            rows, tbl_xml = b[2], b[3]
+            if tbl_xml is not None:
+                # copia del <w:tbl> original (conserva formato)
+                doc.element.body._insert_tbl(parse_xml(tbl_xml))
+            elif rows and rows[0]:
+                doc.element.body._insert_tbl(_tabla_xml(rows, doc._block_width))
+            if rows:
+                tablas.append(rows)
+
+    return tablas
 
-    composer.append(part)
+
+_TAB_BR_RE = re.compile(r"([\t\n])")
+
+
+def _tabla_xml(rows: List[List[str]], width) -> CT_Tbl:
+    """
+    Construye el <w:tbl> directamente en XML (una celda <w:tc><w:p><w:r><w:t> por valor),
+    sin pasar por los setters de python-docx. Tabs y saltos de línea se escriben como
+    <w:tab/> y <w:br/>, igual que run.text.
+    """
+    tbl = CT_Tbl.new_tbl(len(rows), len(rows[0]), width)
+    for tr, row in zip(tbl.iterfind(_w("tr")), rows):
+        for tc, val in zip(tr.iterfind(_w("tc")), row):
+            if not val:
+                continue
+            r = etree.SubElement(tc.find(_P_TAG), _w("r"))
+            for trozo in _TAB_BR_RE.split(val):
+                if trozo == "\n":
+                    etree.SubElement(r, _BR_TAG)
+                elif trozo == "\t":
+                    etree.SubElement(r, _w("tab"))
+                elif trozo:
+                    t = etree.SubElement(r, _T_TAG)
+                    t.text = trozo
+                    if trozo != trozo.strip():
+                        t.set(_XML_SPACE, "preserve")
+    return tbl
 
 
 def _tables_to_xlsx(all_tables: List[Tuple[str, List[List[str]]]]) -> bytes:
@@ -139,91 +461,112 @@ def _tables_to_xlsx(all_tables: List[Tuple[str, List[List[str]]]]) -> bytes:
     Crea un XLSX con todas las tablas encontradas.
     all_tables = [(fuente, filas), ...]
     """
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Tablas"
+    # write_only: las filas se serializan al agregarse, sin mantener la hoja en memoria
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Tablas")
 
     # Cabecera
-    ws.append(["Fuente", "Tabla", "Fila", "Columna", "Valor"])
+    ws.append(("Fuente", "Tabla", "Fila", "Columna", "Valor"))
 
-    table_idx = 0
-    for source_name, rows in all_tables:
-        table_idx += 1
+    # Tuplas simples (sin WriteOnlyCell): no hay estilos que aplicar
+    for table_idx, (source_name, rows) in enumerate(all_tables, start=1):
         for r_i, row in enumerate(rows, start=1):
             for c_i, val in enumerate(row, start=1):
-                ws.append([source_name, table_idx, r_i, c_i, val or ""])
+                ws.append((source_name, table_idx, r_i, c_i, val or ""))
 
     bio = io.BytesIO()
     wb.save(bio)
-    bio.seek(0)
-    return bio.read()
+    return bio.getvalue()
+
+
+# ---------------------------- Rangos ----------------------------
+
+def _indice_headings(bloques: List[Block]) -> List[Tuple[int, int]]:
+    """[(índice en bloques, nivel), ...] de los headings, en orden."""
+    return [(i, int(b[1])) for i, b in enumerate(bloques) if b[0] == "h"]
+
+
+def _fines_rango(heads: List[Tuple[int, int]], total: int) -> List[int]:
+    """
+    fines[h] = fin (exclusivo) del rango que abre heads[h]: índice del siguiente
+    heading de nivel <= el suyo, o 'total'. Una pasada hacia atrás con una pila: O(H).
+    """
+    fines = [total] * len(heads)
+    pila: List[Tuple[int, int]] = []  # (nivel, índice en bloques)
+    for h in range(len(heads) - 1, -1, -1):
+        i, lvl = heads[h]
+        while pila and pila[-1][0] > lvl:
+            pila.pop()
+        if pila:
+            fines[h] = pila[-1][1]
+        pila.append((lvl, i))
+    return fines
 
 
 # ---------------------------- Modos públicos ----------------------------
 
+# Caracteres no válidos en nombres de archivo -> "_"
+_FNAME_TRANS = str.maketrans({c: "_" for c in '\\/:*?"<>|'})
+
+
 def procesar(archivos: List[Dict], niveles: List[int], titulos: List[str],
-             enforce_whitelist: bool = False) -> Dict[str, bytes]:
+             enforce_whitelist: bool = False,
+             generate_xlsx: bool = True) -> Dict[str, bytes]:
     """
     Modo clásico:
       - Un Word 'unificado.docx' con todos los bloques cuyos headings cumplen 'niveles'
         y opcionalmente filtrados por 'titulos' (coincidencia exacta, normalizada).
-      - Un Excel 'tablas.xlsx' con todas las tablas encontradas en esos bloques.
+      - Un Excel 'tablas.xlsx' con todas las tablas encontradas en esos bloques
+        (se omite si generate_xlsx = False).
     """
-    niveles_set = set(int(n) for n in (niveles or [1, 2, 3]))
-    titulo_norm_set = set(base_title(t) for t in (titulos or []))
+    niveles_set = frozenset(int(n) for n in (niveles or [1, 2, 3]))
+    titulo_norm_set = frozenset(base_title(t) for t in (titulos or []))
+    # Caso común (sin títulos ni whitelist efectiva): solo se filtra por nivel
+    filtra_whitelist = enforce_whitelist and bool(_WHITELIST)
+    filtra_texto = filtra_whitelist or bool(titulo_norm_set)
 
     master = _new_doc()
-    composer = Composer(master)
     todas_las_tablas: List[Tuple[str, List[List[str]]]] = []
 
-    for a in archivos:
-        name = a.get("name", "archivo.docx")
-        content = a.get("content", b"")
-        if not content:
-            continue
+    # Parseo (independiente por archivo, en paralelo) y luego composición en serie
+    validos = [a for a in archivos if a.get("content", b"")]
+    parseados = _extraer_bloques_todos([a["content"] for a in validos])
 
-        bloques = _extraer_bloques(content)
+    for a, bloques in zip(validos, parseados):
+        name = a.get("name", "archivo.docx")
 
         # Encuentra cada heading que pase el filtro y su rango
-        for i, b in enumerate(bloques):
-            if b[0] != "h":
-                continue
-            lvl, txt = int(b[1]), str(b[2] or "")
+        heads = _indice_headings(bloques)
+        fines = _fines_rango(heads, len(bloques))
+        for h, (i, lvl) in enumerate(heads):
             if lvl not in niveles_set:
                 continue
-            if enforce_whitelist and not allowed_by_whitelist(lvl, txt):
-                continue
-            if titulo_norm_set and base_title(txt) not in titulo_norm_set:
-                continue
-
-            # Determinar fin: siguiente heading de nivel <= actual
-            j = len(bloques)
-            for k in range(i + 1, len(bloques)):
-                if bloques[k][0] == "h" and int(bloques[k][1]) <= lvl:
-                    j = k
-                    break
+            if filtra_texto:
+                key = bloques[i][3]  # título normalizado al extraer
+                if filtra_whitelist and (lvl, key) not in _WHITELIST:
+                    continue
+                if titulo_norm_set and key not in titulo_norm_set:
+                    continue
 
-            # Añadir el part al composer
-            _append_part(composer, bloques, i, j)
+            j = fines[h]
 
-            # Recolectar tablas del rango
-            for k in range(i + 1, j):
-                if bloques[k][0] == "t":
-                    todas_las_tablas.append((name, bloques[k][2]))
+            # Escribir la sección y recolectar sus tablas en la misma pasada
+            tablas = _append_part(master, bloques, i, j)
+            if generate_xlsx:
+                todas_las_tablas.extend((name, rows) for rows in tablas)
 
     # Serializar Word
     stream = io.BytesIO()
-    composer.doc.save(stream)
-    stream.seek(0)
-    unificado_bytes = stream.read()
+    master.save(stream)
+    unificado_bytes = stream.getvalue()
+
+    out = {"unificado.docx": unificado_bytes}
 
     # Serializar Excel
-    xlsx_bytes = _tables_to_xlsx(todas_las_tablas)
+    if generate_xlsx:
+        out["tablas.xlsx"] = _tables_to_xlsx(todas_las_tablas)
 
-    return {
-        "unificado.docx": unificado_bytes,
-        "tablas.xlsx": xlsx_bytes,
-    }
+    return out
 
 
 def procesar_grouped(archivos: List[Dict], group_level: int,
@@ -235,75 +578,53 @@ def procesar_grouped(archivos: List[Dict], group_level: int,
     - titulos_objetivo: si viene vacío => usa todos los títulos encontrados
     Salida: dict {"<TituloLimpio>.docx": bytes, ...}
     """
-    objetivos_norm = set(base_title(t) for t in (titulos_objetivo or []))
-    composers: Dict[str, Composer] = {}
+    group_level = int(group_level)
+    objetivos_norm = frozenset(base_title(t) for t in (titulos_objetivo or []))
+    filtra_whitelist = enforce_whitelist and bool(_WHITELIST)
+    docs: Dict[str, Document] = {}
     visibles: Dict[str, str] = {}
 
-    def get_comp(key_norm: str, visible: str) -> Composer:
-        if key_norm not in composers:
-            tmp = _new_doc()
-            composers[key_norm] = Composer(tmp)
+    def get_doc(key_norm: str, visible: str) -> Document:
+        if key_norm not in docs:
+            docs[key_norm] = _new_doc()
             if visible:
                 visibles.setdefault(key_norm, visible)
-        return composers[key_norm]
-
-    # Descubrir todos los títulos nivel group_level
-    all_norm: set = set()
-    for a in archivos:
-        content = a.get("content", b"") or b""
-        if not content:
-            continue
-        bloques = _extraer_bloques(content)
-        for kind, lvl, txt in bloques:
-            if kind == "h" and int(lvl) == int(group_level) and (txt or "").strip():
-                if enforce_whitelist and not allowed_by_whitelist(int(lvl), txt):
-                    continue
-                all_norm.add(base_title(txt))
-                visibles.setdefault(base_title(txt), str(txt))
-
-    target_keys = objetivos_norm or all_norm
-    if not target_keys:
-        return {}
-
-    # Para cada archivo, apendea las secciones de cada título target
-    for a in archivos:
-        content = a.get("content", b"") or b""
-        if not content:
-            continue
-        bloques = _extraer_bloques(content)
-
-        # Índices de headings
-        for i, b in enumerate(bloques):
-            if b[0] != "h":
-                continue
-            lvl, txt = int(b[1]), str(b[2] or "")
+        return docs[key_norm]
+
+    # Parseo de todos los archivos de una vez (caché + pool) y composición en serie.
+    # Una sola pasada por archivo: cada heading de nivel group_level que sea
+    # objetivo abre su rango y se escribe en el documento de su título.
+    # Sin objetivos => todos los títulos con texto de ese nivel.
+    validos = [a for a in archivos if a.get("content", b"")]
+    parseados = _extraer_bloques_todos([a["content"] for a in validos])
+
+    for bloques in parseados:
+        heads = _indice_headings(bloques)
+        fines = _fines_rango(heads, len(bloques))
+        for h, (i, lvl) in enumerate(heads):
             if lvl != group_level:
                 continue
-            key = base_title(txt)
-            if key not in target_keys:
+            txt = str(bloques[i][2] or "")
+            if not objetivos_norm and not txt.strip():
+                continue
+            key = bloques[i][3]  # título normalizado al extraer
+            if filtra_whitelist and (group_level, key) not in _WHITELIST:
                 continue
-            if enforce_whitelist and not allowed_by_whitelist(lvl, txt):
+            if objetivos_norm and key not in objetivos_norm:
                 continue
 
-            # fin del rango: siguiente heading de nivel <= group_level
-            j = len(bloques)
-            for k in range(i + 1, len(bloques)):
-                if bloques[k][0] == "h" and int(bloques[k][1]) <= group_level:
-                    j = k
-                    break
+            j = fines[h]
 
-            comp = get_comp(key, visibles.get(key, txt))
-            _append_part(comp, bloques, i, j)
+            _append_part(get_doc(key, txt), bloques, i, j)
 
-    # Serializar cada composer
+    # Serializar cada documento
     out: Dict[str, bytes] = {}
-    for key_norm, comp in composers.items():
+    for key_norm, doc in docs.items():
         visible = (visibles.get(key_norm) or key_norm).strip()
-        safe = re.sub(r'[\\/:*?"<>|]+', "_", visible).strip() or key_norm or "titulo"
+        safe = visible.translate(_FNAME_TRANS).strip() or key_norm or "titulo"
         filename = f"{safe}.docx"
         stream = io.BytesIO()
-        comp.doc.save(stream)
-        stream.seek(0)
-        out[filename] = stream.read()
+        doc.save(stream)
+        out[filename] = stream.getvalue()
 
     return out
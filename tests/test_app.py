@@ -0,0 +1,85 @@
+# tests/test_app.py
+import base64
+import io
+
+import pytest
+from docx import Document
+
+from app import app, DOCX_MIMETYPE
+
+
+def _docx_bytes() -> bytes:
+    doc = Document()
+    doc.add_heading("Alcance", level=1)
+    doc.add_paragraph("texto")
+    doc.add_heading("Detalle", level=2)
+    doc.add_paragraph("más texto")
+    bio = io.BytesIO()
+    doc.save(bio)
+    return bio.getvalue()
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def test_merge_upload_devuelve_docx(client):
+    resp = client.post("/api/merge/upload", data={
+        "archivos": [(io.BytesIO(_docx_bytes()), "a.docx"), (io.BytesIO(_docx_bytes()), "b.docx")],
+        "niveles": "1",
+        "titulos_exactos": "ALCANCE",
+    })
+
+    assert resp.status_code == 200
+    assert resp.mimetype == DOCX_MIMETYPE
+    unificado = Document(io.BytesIO(resp.data))
+    assert [p.text for p in unificado.paragraphs] == ["Alcance", "texto", "más texto"] * 2
+
+
+def test_merge_upload_niveles_separados_por_coma(client):
+    resp = client.post("/api/merge/upload", data={
+        "archivos": (io.BytesIO(_docx_bytes()), "a.docx"),
+        "niveles": "2, 3",
+    })
+
+    assert resp.status_code == 200
+    assert [p.text for p in Document(io.BytesIO(resp.data)).paragraphs] == ["Detalle", "más texto"]
+
+
+def test_merge_upload_niveles_invalidos(client):
+    resp = client.post("/api/merge/upload", data={
+        "archivos": (io.BytesIO(_docx_bytes()), "a.docx"),
+        "niveles": "x",
+    })
+
+    assert resp.status_code == 400
+
+
+def test_merge_include_xlsx(client):
+    archivos = [{"name": "a.docx", "content": base64.b64encode(_docx_bytes()).decode("ascii")}]
+
+    con_xlsx = client.post("/api/merge", json={"archivos": archivos})
+    sin_xlsx = client.post("/api/merge", json={"archivos": archivos, "include_xlsx": False})
+
+    assert sorted(con_xlsx.get_json()) == ["tablas.xlsx", "unificado.docx"]
+    assert sorted(sin_xlsx.get_json()) == ["unificado.docx"]
+
+
+def test_headings_y_merge_agrupado_comparten_decodificacion(client):
+    archivos = [
+        {"name": "a.docx", "content": base64.b64encode(_docx_bytes()).decode("ascii")},
+        {"name": "roto.docx", "content": "no*es*base64"},
+    ]
+
+    headings = client.post("/api/headings", json={"archivos": archivos}).get_json()
+    agrupado = client.post("/api/merge", json={
+        "archivos": archivos, "group_by_title": True, "return_array": True,
+    }).get_json()
+
+    assert headings == {
+        "a.docx": [{"level": 1, "text": "Alcance"}, {"level": 2, "text": "Detalle"}],
+        "roto.docx": [],
+    }
+    assert [f["filename"] for f in agrupado["files"]] == ["Alcance.docx"]
+    assert Document(io.BytesIO(base64.b64decode(agrupado["files"][0]["content"])))
@@ -0,0 +1,52 @@
+# tests/test_handlers.py
+import base64
+
+import handlers
+
+
+def test_decode_archivos_base64_valido_y_con_saltos():
+    contenido = bytes(range(256)) * 4
+    b64 = base64.b64encode(contenido).decode("ascii")
+    envuelto = base64.encodebytes(contenido).decode("ascii")  # líneas de 76 caracteres
+
+    archivos = handlers.decode_archivos({"archivos": [
+        {"name": "a.docx", "content": b64},
+        {"name": "b.docx", "content": envuelto},
+    ]})
+
+    assert [a["content"] for a in archivos] == [contenido, contenido]
+
+
+def test_decode_archivos_base64_invalido_queda_vacio():
+    archivos = handlers.decode_archivos({"archivos": [
+        {"name": "a.docx", "content": "no*es*base64"},
+        {"name": "b.docx", "content": "QUJD"},
+    ]})
+
+    assert archivos == [
+        {"name": "a.docx", "content": b""},
+        {"name": "b.docx", "content": b"ABC"},
+    ]
+
+
+def test_decode_archivos_entradas_incompletas():
+    archivos = handlers.decode_archivos({"archivos": [None, {"content": ""}, {"name": "c.docx"}]})
+
+    assert archivos == [
+        {"name": "archivo.docx", "content": b""},
+        {"name": "archivo.docx", "content": b""},
+        {"name": "c.docx", "content": b""},
+    ]
+    assert handlers.decode_archivos({}) == []
+
+
+def test_encode_result_ida_y_vuelta():
+    result = {"unificado.docx": b"\x00\x01docx", "tablas.xlsx": b""}
+
+    out = handlers.encode_result(result)
+
+    assert out == {k: base64.b64encode(v).decode("ascii") for k, v in result.items()}
+    assert handlers.decode_archivos({"archivos": [
+        {"name": k, "content": v} for k, v in out.items()
+    ]}) == [{"name": "unificado.docx", "content": result["unificado.docx"]},
+            {"name": "tablas.xlsx", "content": b""}]
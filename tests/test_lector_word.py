@@ -0,0 +1,232 @@
+# tests/test_lector_word.py
+import io
+import random
+import zipfile
+
+import pytest
+from docx import Document
+from docx.enum.style import WD_STYLE_TYPE
+from docx.enum.text import WD_BREAK
+
+import lector_word
+
+
+def _docx_bytes(doc) -> bytes:
+    bio = io.BytesIO()
+    doc.save(bio)
+    return bio.getvalue()
+
+
+def _reemplazar_parte(doc_bytes: bytes, nombre: str, contenido: bytes) -> bytes:
+    """Copia del DOCX con la parte 'nombre' sustituida por 'contenido'."""
+    bio = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(doc_bytes)) as src, \
+            zipfile.ZipFile(bio, "w", zipfile.ZIP_DEFLATED) as dst:
+        for item in src.infolist():
+            data = contenido if item.filename == nombre else src.read(item.filename)
+            dst.writestr(item, data)
+    return bio.getvalue()
+
+
+# ---------------------------- Seguridad ----------------------------
+
+def test_extraer_bloques_rechaza_entidades_externas(tmp_path):
+    secreto = tmp_path / "secret.txt"
+    secreto.write_text("SECRET_CONTENT_42")
+    document_xml = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        f'<!DOCTYPE w:document [<!ENTITY xxe SYSTEM "file://{secreto}">]>'
+        f'<w:document xmlns:w="{lector_word.W_NS}"><w:body>'
+        '<w:p><w:r><w:t>&xxe;</w:t></w:r></w:p>'
+        '</w:body></w:document>'
+    ).encode("utf-8")
+    doc_bytes = _reemplazar_parte(_docx_bytes(Document()), "word/document.xml", document_xml)
+
+    with pytest.raises(ValueError):
+        lector_word._extraer_bloques(doc_bytes)
+
+
+# ---------------------------- Rangos ----------------------------
+
+def _fines_ingenuo(heads, total):
+    fines = []
+    for h, (_, lvl) in enumerate(heads):
+        fin = total
+        for i, otro in heads[h + 1:]:
+            if otro <= lvl:
+                fin = i
+                break
+        fines.append(fin)
+    return fines
+
+
+def test_fines_rango_igual_a_recorrido_ingenuo():
+    rnd = random.Random(1234)
+    for _ in range(500):
+        total = rnd.randint(0, 40)
+        indices = sorted(rnd.sample(range(total), rnd.randint(0, total)))
+        heads = [(i, rnd.randint(1, 4)) for i in indices]
+        assert lector_word._fines_rango(heads, total) == _fines_ingenuo(heads, total)
+
+
+# ---------------------------- Extracción ----------------------------
+
+def test_extraer_bloques_conserva_tabs_y_saltos():
+    doc = Document()
+    doc.add_heading("1.\tIntroducción", level=1)
+    p = doc.add_paragraph("A\nB")
+    p.add_run().add_break()  # salto de línea al final: se recorta con strip()
+    doc.add_paragraph("no").add_run().add_break(WD_BREAK.PAGE)  # salto de página: sin texto
+    doc.add_table(rows=1, cols=1).cell(0, 0).text = "x\ty"
+
+    bloques = lector_word._extraer_bloques(_docx_bytes(doc))
+
+    assert bloques[0][:3] == ("h", 1, "1.\tIntroducción")
+    assert bloques[1] == ("p", None, "A\nB", None)
+    assert bloques[2] == ("p", None, "no", None)
+    assert bloques[3][2] == [["x\ty"]]
+
+
+def test_procesar_escribe_tabs_y_saltos():
+    doc = Document()
+    doc.add_heading("1.\tIntroducción", level=1)
+    doc.add_paragraph("A\nB")
+    doc.add_table(rows=1, cols=1).cell(0, 0).text = "x\ty"
+    archivos = [{"name": "a.docx", "content": _docx_bytes(doc)}]
+
+    out = lector_word.procesar(archivos, niveles=[1], titulos=["1. introducción"])
+
+    unificado = Document(io.BytesIO(out["unificado.docx"]))
+    assert [p.text for p in unificado.paragraphs] == ["1.\tIntroducción", "A\nB"]
+    assert unificado.tables[0].cell(0, 0).text == "x\ty"
+
+
+def test_tablas_con_estilos_ajenos_no_se_copian():
+    doc = Document()
+    doc.styles.add_style("MiTabla", WD_STYLE_TYPE.TABLE)
+    doc.styles.add_style("CeldaEsp", WD_STYLE_TYPE.PARAGRAPH)
+    doc.add_heading("Datos", level=1)
+    propia = doc.add_table(rows=1, cols=1, style="MiTabla")
+    propia.cell(0, 0).paragraphs[0].text = "a"
+    celda = doc.add_table(rows=1, cols=1, style="Table Grid")
+    celda.cell(0, 0).paragraphs[0].text = "b"
+    celda.cell(0, 0).paragraphs[0].style = "CeldaEsp"
+    comun = doc.add_table(rows=1, cols=1, style="Table Grid")
+    comun.cell(0, 0).text = "c"
+    doc_bytes = _docx_bytes(doc)
+
+    tablas = [b for b in lector_word._extraer_bloques(doc_bytes) if b[0] == "t"]
+    assert [b[3] is not None for b in tablas] == [False, False, True]
+
+    out = lector_word.procesar([{"name": "a.docx", "content": doc_bytes}], [1], [])
+    unificado = Document(io.BytesIO(out["unificado.docx"]))
+    ids = {s.style_id for s in unificado.styles}
+    usados = unificado.element.body.xpath(
+        ".//w:tblStyle/@w:val | .//w:pStyle/@w:val | .//w:rStyle/@w:val")
+    assert set(usados) <= ids
+    assert [t.cell(0, 0).text for t in unificado.tables] == ["a", "b", "c"]
+
+
+def _doc_con_tabla() -> bytes:
+    doc = Document()
+    doc.add_heading("Uno", level=1)
+    doc.add_paragraph("texto")
+    doc.add_table(rows=1, cols=1).cell(0, 0).text = "celda"
+    return _docx_bytes(doc)
+
+
+def _falla(*args, **kwargs):
+    raise AssertionError("no debería llamarse")
+
+
+def test_headings_from_docx_no_extrae_tablas(monkeypatch):
+    doc_bytes = _doc_con_tabla()
+    monkeypatch.setattr(lector_word, "_bloques_cache", lector_word.OrderedDict())
+    monkeypatch.setattr(lector_word, "_filas_tabla", _falla)
+    monkeypatch.setattr(lector_word, "_tabla_copiable", _falla)
+
+    assert lector_word.headings_from_docx(doc_bytes) == [{"level": 1, "text": "Uno"}]
+    assert not lector_word._bloques_cache
+
+
+def test_headings_from_docx_usa_extraccion_cacheada(monkeypatch):
+    doc_bytes = _doc_con_tabla()
+    monkeypatch.setattr(lector_word, "_bloques_cache", lector_word.OrderedDict())
+    lector_word.procesar([{"name": "a.docx", "content": doc_bytes}], [1], [])
+    monkeypatch.setattr(lector_word, "_extraer_bloques", _falla)
+
+    assert lector_word.headings_from_docx(doc_bytes) == [{"level": 1, "text": "Uno"}]
+
+
+
+def test_extraer_bloques_tablas_combinadas_y_anidadas():
+    doc = Document()
+    doc.add_heading("Tabla", level=2)
+    tabla = doc.add_table(rows=3, cols=3)
+    for r, fila in enumerate(tabla.rows):
+        for c, celda in enumerate(fila.cells):
+            celda.text = f"{r}{c}"
+    tabla.cell(0, 0).merge(tabla.cell(0, 1)).text = "span"
+    tabla.cell(1, 2).merge(tabla.cell(2, 2)).text = "vmerge"
+    tabla.cell(1, 0).add_table(rows=1, cols=1).cell(0, 0).text = "anidada"
+    doc.add_paragraph("después")
+    doc_bytes = _docx_bytes(doc)
+
+    bloques = lector_word._extraer_bloques(doc_bytes)
+
+    tabla_docx = Document(io.BytesIO(doc_bytes)).tables[0]
+    esperado = [[c.text.strip() for c in fila.cells] for fila in tabla_docx.rows]
+    assert [b[0] for b in bloques] == ["h", "t", "p"]
+    assert bloques[0] == ("h", 2, "Tabla", "tabla")
+    assert bloques[1][2] == esperado
+    assert esperado[0][:2] == ["span", "span"] and esperado[2][2] == "vmerge"
+    assert bloques[2] == ("p", None, "después", None)
+
+
+# ---------------------------- Modos públicos ----------------------------
+
+def _doc_secciones(titulos) -> bytes:
+    doc = Document()
+    for titulo, sub in titulos:
+        doc.add_heading(titulo, level=1)
+        doc.add_paragraph(f"texto {titulo}")
+        doc.add_heading(sub, level=2)
+        doc.add_table(rows=1, cols=2).cell(0, 1).text = sub
+    return _docx_bytes(doc)
+
+
+def test_procesar_smoke():
+    archivos = [
+        {"name": "a.docx", "content": _doc_secciones([("Alcance", "A1"), ("Riesgos", "R1")])},
+        {"name": "vacio.docx", "content": b""},
+        {"name": "b.docx", "content": _doc_secciones([("Alcance", "A2")])},
+    ]
+
+    out = lector_word.procesar(archivos, niveles=[1], titulos=["ALCANCE"])
+
+    # los sub-headings del rango no se copian; sí sus párrafos y tablas
+    unificado = Document(io.BytesIO(out["unificado.docx"]))
+    assert [p.text for p in unificado.paragraphs] == [
+        "Alcance", "texto Alcance", "Alcance", "texto Alcance",
+    ]
+    assert len(unificado.tables) == 2
+    assert "tablas.xlsx" in out
+
+    solo_docx = lector_word.procesar(archivos, [2], [], generate_xlsx=False)
+    assert list(solo_docx) == ["unificado.docx"]
+
+
+def test_procesar_grouped_smoke():
+    archivos = [
+        {"name": "a.docx", "content": _doc_secciones([("Alcance", "A1"), ("Riesgos: v2", "R1")])},
+        {"name": "b.docx", "content": _doc_secciones([("alcance", "A2")])},
+    ]
+
+    out = lector_word.procesar_grouped(archivos, group_level=1, titulos_objetivo=[])
+
+    assert sorted(out) == ["Alcance.docx", "Riesgos_ v2.docx"]
+    alcance = Document(io.BytesIO(out["Alcance.docx"]))
+    assert [p.text for p in alcance.paragraphs] == [
+        "Alcance", "texto Alcance", "alcance", "texto alcance",
+    ]
+    assert [t.cell(0, 1).text for t in alcance.tables] == ["A1", "A2"]